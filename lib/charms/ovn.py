@@ -11,17 +11,121 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import atexit
+import codecs
+import collections
+import concurrent.futures
+import contextlib
+import copy
+import functools
+import inspect
+import itertools
 import json
 import os
+import socket
+import string
 import subprocess
+import threading
+import time
+
+try:
+    # NOTE: orjson is considerably faster at parsing the potentially large
+    # JSON documents produced by the database tools, use it when available.
+    from orjson import loads as _json_loads
+except ImportError:
+    _json_loads = json.loads
 
 
 OVS_RUNDIR = '/var/run/openvswitch'
 
+# Tools that can run in daemon mode, holding a copy of the database in memory
+# that subsequent commands can be executed against.
+CTL_DAEMON_TOOLS = ('ovn-nbctl', 'ovn-sbctl',)
+
+_ctl_daemons = {}
+
+# NOTE(fnordahl): The ovsdb-server processes for the OVN databases use a
+# non-standard naming scheme for their daemon control socket and we need
+# to pass the full path to the socket.
+_CTL_PATHS = {
+    target: os.path.join(OVS_RUNDIR, target + '.ctl')
+    for target in ('ovnnb_db', 'ovnsb_db',)
+}
+
+# Map of control socket path to connected socket and the lock serializing
+# requests on it.
+_unixctl_sockets = {}
+_unixctl_sockets_lock = threading.Lock()
+_unixctl_ids = itertools.count()
+
+
+# Translation table turning `cluster/status` output labels into keys.
+_STATUS_KEY_TRANS = str.maketrans(
+    string.ascii_uppercase + ' ', string.ascii_lowercase + '_')
+# Translation table removing parentheses around full cluster and server IDs.
+_PARENS_TRANS = str.maketrans('', '', '()')
+
+# Number of seconds to reuse results of daemon status queries for.
+STATUS_CACHE_TTL = 1
+
+
+def _ttl_cache(ttl):
+    """Decorator caching results of function for ttl seconds.
+
+    Results are cached per combination of arguments, with defaults filled
+    in so that e.g. `f(x)` and `f(x, y=None)` share a result.  Callers get a
+    copy of the cached result so they may modify it freely.  Exceptions are
+    not cached.  The decorated function gains a `cache_clear` method.
 
-def _run(*args):
+    :param ttl: Number of seconds to keep results for
+    :type ttl: Union[int, float]
+    """
+    def wrap(f):
+        cache = {}
+        signature = inspect.signature(f)
+
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key = tuple(bound.arguments.items())
+            now = time.monotonic()
+            if key in cache:
+                expires, result = cache[key]
+                if now < expires:
+                    return copy.deepcopy(result)
+            result = f(*args, **kwargs)
+            cache[key] = (now + ttl, result)
+            return copy.deepcopy(result)
+
+        wrapper.cache_clear = cache.clear
+        return wrapper
+    return wrap
+
+
+# NOTE: On Python 3.10 and later CPython launches commands with `vfork`,
+# avoiding a full `fork` of the, potentially large, hook process.  Passing
+# `preexec_fn` or user/group options (`user`, `group`, `extra_groups`) to
+# `subprocess.run` in `_run` and `_run_bytes` would disable that.
+def _run(*args, input=None):
     """Run a process, check result, capture decoded output from STDERR/STDOUT.
 
+    :param args: Command and arguments to run
+    :type args: Tuple[str, ...]
+    :param input: Data to pass to STDIN of process
+    :type input: Optional[str]
+    :returns: Information about the completed process
+    :rtype: subprocess.CompletedProcess
+    :raises subprocess.CalledProcessError
+    """
+    return subprocess.run(
+        args, input=input, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+        check=True, universal_newlines=True)
+
+
+def _run_bytes(*args):
+    """Run a process, check result, capture raw output from STDERR/STDOUT.
+
     :param args: Command and arguments to run
     :type args: Tuple[str, ...]
     :returns: Information about the completed process
@@ -29,13 +133,150 @@ def _run(*args):
     :raises subprocess.CalledProcessError
     """
     return subprocess.run(
-        args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, check=True,
-        universal_newlines=True)
+        args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, check=True)
+
+
+def _unixctl_path(target):
+    """Get path to control socket for target, the way `ovs-appctl` does.
+
+    :param target: Name of daemon or full path to control socket.
+    :type target: str
+    :returns: Path to control socket
+    :rtype: str
+    :raises: OSError
+    """
+    if target.startswith('/'):
+        return target
+    with open(os.path.join(OVS_RUNDIR, target + '.pid')) as f:
+        pid = f.read().strip()
+    return os.path.join(OVS_RUNDIR, '{}.{}.ctl'.format(target, pid))
+
+
+def _unixctl_connection(ctl):
+    """Get connection to control socket, connect if needed.
+
+    :param ctl: Path to control socket
+    :type ctl: str
+    :returns: Connected socket and lock to hold while using it
+    :rtype: Tuple[socket.socket, threading.Lock]
+    :raises: OSError
+    """
+    with _unixctl_sockets_lock:
+        if ctl not in _unixctl_sockets:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(ctl)
+            except OSError:
+                sock.close()
+                raise
+            _unixctl_sockets[ctl] = (sock, threading.Lock())
+        return _unixctl_sockets[ctl]
+
+
+def _unixctl_disconnect(ctl):
+    """Close and forget cached connection to control socket, if any.
+
+    :param ctl: Path to control socket
+    :type ctl: str
+    """
+    with _unixctl_sockets_lock:
+        conn = _unixctl_sockets.pop(ctl, None)
+    if conn:
+        conn[0].close()
+
+
+def _unixctl_recv(sock, ctl, request_id):
+    """Read from control socket until reply to request arrives.
+
+    Replies to other requests, e.g. left over from an earlier call that
+    failed, are skipped.
+
+    :param sock: Connected socket
+    :type sock: socket.socket
+    :param ctl: Path to control socket, used in error messages
+    :type ctl: str
+    :param request_id: ID of request to wait for reply to
+    :type request_id: int
+    :returns: Reply
+    :rtype: Dict[str, Any]
+    :raises: OSError
+    """
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    decoder = json.JSONDecoder()
+    buf = ''
+    while True:
+        data = sock.recv(4096)
+        if not data:
+            raise ConnectionResetError('connection to {} closed'.format(ctl))
+        buf += utf8.decode(data)
+        while True:
+            buf = buf.lstrip()
+            try:
+                reply, end = decoder.raw_decode(buf)
+            except ValueError:
+                # incomplete reply, keep reading
+                break
+            buf = buf[end:]
+            if reply.get('id') == request_id:
+                return reply
+
+
+def _unixctl(target, command, *args):
+    """Execute command on daemon over its JSON-RPC control socket.
+
+    Connections are kept open and reused for subsequent calls to the same
+    control socket.  A stale cached connection is replaced once if sending
+    the request on it fails.
+
+    :param target: Name of daemon or full path to control socket.
+    :type target: str
+    :param command: Command to execute
+    :type command: str
+    :param args: Arguments to command
+    :type args: Tuple[str, ...]
+    :returns: Output from command
+    :rtype: str
+    :raises: OSError if the request could not be sent,
+             subprocess.CalledProcessError if the command failed or no reply
+             was received after sending it.
+    """
+    cmd = ('ovs-appctl', '-t', target, command) + args
+    ctl = _unixctl_path(target)
+    request_id = next(_unixctl_ids)
+    request = json.dumps({
+        'method': command,
+        'params': list(args),
+        'id': request_id,
+    }).encode('utf-8')
+    for reconnect in (True, False):
+        sock, lock = _unixctl_connection(ctl)
+        with lock:
+            try:
+                sock.sendall(request)
+            except OSError:
+                _unixctl_disconnect(ctl)
+                if reconnect:
+                    continue
+                raise
+            try:
+                reply = _unixctl_recv(sock, ctl, request_id)
+            except OSError as e:
+                _unixctl_disconnect(ctl)
+                # NOTE: The daemon may already have executed the command, so
+                # raise an error the caller will not retry it on.
+                raise subprocess.CalledProcessError(2, cmd, output=str(e))
+        break
+    if reply.get('error') is not None:
+        raise subprocess.CalledProcessError(2, cmd, output=reply['error'])
+    return reply['result']
 
 
 def ovs_appctl(target, *args):
     """Run `ovs-appctl` for target with args and return output.
 
+    The command is sent directly to the daemon's control socket when
+    possible, `ovs-appctl` is only executed if the request could not be sent.
+
     :param target: Name of daemon to contact.  Unless target begins with '/',
                    `ovs-appctl` looks for a pidfile and will build the path to
                    a /var/run/openvswitch/target.pid.ctl for you.
@@ -46,17 +287,39 @@ def ovs_appctl(target, *args):
     :rtype: str
     :raises: subprocess.CalledProcessError
     """
-    # NOTE(fnordahl): The ovsdb-server processes for the OVN databases use a
-    # non-standard naming scheme for their daemon control socket and we need
-    # to pass the full path to the socket.
-    if target in ('ovnnb_db', 'ovnsb_db',):
-        target = os.path.join(OVS_RUNDIR, target + '.ctl')
+    target = _CTL_PATHS.get(target, target)
+    if args:
+        try:
+            return _unixctl(target, *args)
+        except OSError:
+            pass
     return _run('ovs-appctl', '-t', target, *args).stdout
 
 
+def _iter_lines(text):
+    """Iterate over lines of text without building a list of them first.
+
+    :param text: Text to iterate over
+    :type text: str
+    :returns: Lines without line terminator
+    :rtype: Iterator[str]
+    """
+    start = 0
+    while start < len(text):
+        end = text.find('\n', start)
+        if end == -1:
+            end = len(text)
+        yield text[start:end]
+        start = end + 1
+
+
+@_ttl_cache(STATUS_CACHE_TTL)
 def cluster_status(target, schema=None):
     """Retrieve status information from clustered OVSDB.
 
+    Results are reused for STATUS_CACHE_TTL seconds, use
+    `cluster_status.cache_clear()` to force a fresh query.
+
     :param target: Usually one of 'ovsdb-server', 'ovnnb_db', 'ovnsb_db', can
                    also be full path to control socket.
     :type target: str
@@ -72,21 +335,19 @@ def cluster_status(target, schema=None):
     }
     status = {}
     k = ''
-    for line in ovs_appctl(
+    for line in _iter_lines(ovs_appctl(
             target,
             'cluster/status',
-            schema or schema_map.get(target)).splitlines():
+            schema or schema_map.get(target))):
         if k and line.startswith(' '):
             status[k].append(line.lstrip())
-        elif ':' in line:
-            k, v = line.split(':', 1)
-            k = k.lower()
-            k = k.replace(' ', '_')
+            continue
+        key, sep, v = line.partition(':')
+        if sep:
+            k = key.translate(_STATUS_KEY_TRANS)
             if v:
                 if k in ('cluster_id', 'server_id',):
-                    v = v.replace('(', '')
-                    v = v.replace(')', '')
-                    status[k] = tuple(v.split())
+                    status[k] = tuple(v.translate(_PARENS_TRANS).split())
                 else:
                     status[k] = v.lstrip()
             else:
@@ -94,6 +355,29 @@ def cluster_status(target, schema=None):
     return status
 
 
+def cluster_status_many(targets):
+    """Retrieve status information from multiple clustered OVSDBs at once.
+
+    The databases are queried concurrently, schema names are deduced from
+    the targets.
+
+    :param targets: Targets as accepted by `cluster_status`
+    :type targets: Iterable[str]
+    :returns: Structured cluster status data for each target
+    :rtype: Dict[str, Dict[str, Union[str, List[str], Tuple[str, str]]]]
+    :raises: subprocess.CalledProcessError
+    """
+    # NOTE: Remove duplicates to avoid querying the same target twice.
+    # Targets resolving to the same control socket may still be queried
+    # concurrently, `_unixctl` serializes requests on a shared connection.
+    targets = list(collections.OrderedDict.fromkeys(targets))
+    if not targets:
+        return {}
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=len(targets)) as executor:
+        return dict(zip(targets, executor.map(cluster_status, targets)))
+
+
 def is_cluster_leader(target, schema=None):
     """Retrieve status information from clustered OVSDB.
 
@@ -111,19 +395,31 @@ def is_cluster_leader(target, schema=None):
         return False
 
 
+@_ttl_cache(STATUS_CACHE_TTL)
 def is_northd_active():
     """Query `ovn-northd` for active status.
 
+    Results are reused for STATUS_CACHE_TTL seconds, use
+    `is_northd_active.cache_clear()` to force a fresh query.
+
     :returns: True if local `ovn-northd` instance is active, False otherwise
     :rtype: bool
     """
     try:
-        for line in ovs_appctl('ovn-northd', 'status').splitlines():
-            if line.startswith('Status:') and 'active' in line:
-                return True
+        out = ovs_appctl('ovn-northd', 'status')
     except subprocess.CalledProcessError:
-        pass
-    return False
+        return False
+    if out.startswith('Status:'):
+        start = 0
+    else:
+        start = out.find('\nStatus:')
+        if start == -1:
+            return False
+        start += 1
+    end = out.find('\n', start)
+    if end == -1:
+        end = len(out)
+    return 'active' in out[start:end]
 
 
 def add_br(bridge, external_id=None):
@@ -165,13 +461,46 @@ def add_port(bridge, port, external_id=None):
     :raises: subprocess.CalledProcessError
     """
     _run('ip', 'link', 'set', port, 'up')
-    _run('ovs-vsctl', 'add-port', bridge, port)
+    cmd = ['ovs-vsctl', 'add-port', bridge, port]
     if external_id:
-        ports = SimpleOVSDB('ovs-vsctl', 'port')
-        for port in ports.find('name={}'.format(port)):
-            ports.set(port['_uuid'],
-                      'external_ids:{}'.format(external_id[0]),
-                      external_id[1])
+        # NOTE: `ovs-vsctl` accepts the port name as record identifier, so we
+        # can set the external_id in the same transaction as adding the port.
+        cmd.extend(('--', 'set', 'port', port,
+                    'external_ids:{}={}'.format(*external_id)))
+    _run(*cmd)
+
+
+def add_ports(bridge, ports):
+    """Add multiple ports to bridge in one transaction.
+
+    Links are brought up with a single `ip -batch` invocation and the ports
+    are added, along with any external_id, in a single `ovs-vsctl`
+    transaction.
+
+    :param bridge: Name of bridge to attach ports to
+    :type bridge: str
+    :param ports: Name of port as represented in netdev and optional
+                  external_id Key-value pair for each port
+    :type ports: Iterable[Tuple[str, Optional[Tuple[str,str]]]]
+    :raises: subprocess.CalledProcessError
+    """
+    # NOTE: Adding the same port twice would fail the whole transaction, keep
+    # the first occurrence of each port only.
+    unique_ports = collections.OrderedDict()
+    for port, external_id in ports:
+        unique_ports.setdefault(port, external_id)
+    ports = list(unique_ports.items())
+    if not ports:
+        return
+    _run('ip', '-batch', '-',
+         input=''.join('link set {} up\n'.format(port) for port, _ in ports))
+    cmd = ['ovs-vsctl']
+    for port, external_id in ports:
+        cmd.extend(('--', 'add-port', bridge, port))
+        if external_id:
+            cmd.extend(('--', 'set', 'port', port,
+                        'external_ids:{}={}'.format(*external_id)))
+    _run(*cmd)
 
 
 def del_port(bridge, port):
@@ -186,6 +515,53 @@ def del_port(bridge, port):
     _run('ovs-vsctl', 'del-port', bridge, port)
 
 
+def ctl_daemon(tool):
+    """Get control socket for `tool` running in daemon mode, start if needed.
+
+    :param tool: Name of tool, must be one of CTL_DAEMON_TOOLS
+    :type tool: str
+    :returns: Path to control socket of daemon
+    :rtype: str
+    :raises: ValueError, subprocess.CalledProcessError
+    """
+    if tool not in CTL_DAEMON_TOOLS:
+        raise ValueError('{} does not support daemon mode'.format(tool))
+    if tool not in _ctl_daemons:
+        # NOTE: The daemon prints the path to its control socket on STDOUT,
+        # keep STDERR separate so log messages do not end up in the path.
+        ctl = subprocess.check_output(
+            (tool, '--detach'), universal_newlines=True).strip()
+        if not _ctl_daemons:
+            # NOTE: The daemon keeps running after we exit, make sure it is
+            # stopped at the end of the hook.
+            atexit.register(stop_ctl_daemons)
+        _ctl_daemons[tool] = ctl
+    return _ctl_daemons[tool]
+
+
+def stop_ctl_daemons():
+    """Stop any tool daemons started by `ctl_daemon`.
+
+    Called automatically at exit when any daemons have been started.  An
+    attempt is made to stop every daemon, the first error encountered is
+    raised afterwards.
+
+    :raises: subprocess.CalledProcessError, OSError
+    """
+    atexit.unregister(stop_ctl_daemons)
+    errors = []
+    while _ctl_daemons:
+        _, ctl = _ctl_daemons.popitem()
+        try:
+            ovs_appctl(ctl, 'exit')
+        except (subprocess.CalledProcessError, OSError) as e:
+            errors.append(e)
+        finally:
+            _unixctl_disconnect(ctl)
+    if errors:
+        raise errors[0]
+
+
 def list_ports(bridge):
     """List ports on a bridge.
 
@@ -217,9 +593,22 @@ class SimpleOVSDB(object):
     for br in bridges:
         if br['name'] == 'br-test':
             bridges.set(br['uuid'], 'external_ids:charm', 'managed')
+
+    Each command normally runs the tool afresh, which has to retrieve a copy
+    of the database before doing any work.  For tools supporting it the
+    commands may instead be executed by a resident daemon:
+    lsps = SimpleOVSDB('ovn-nbctl', 'logical_switch_port', daemon=True)
+    ...
+    stop_ctl_daemons()
+
+    Multiple changes can be applied in a single transaction:
+    opvs = SimpleOVSDB('ovs-vsctl', 'Open_vSwitch')
+    with opvs.transaction():
+        opvs.set('.', 'external_ids:a', 'x')
+        opvs.remove('.', 'external_ids', 'b')
     """
 
-    def __init__(self, tool, table):
+    def __init__(self, tool, table, daemon=False):
         """SimpleOVSDB constructor
 
         :param tool: Which tool with database commands to operate on.
@@ -227,36 +616,125 @@ class SimpleOVSDB(object):
         :type tool: str
         :param table: Which table to operate on
         :type table: str
+        :param daemon: Execute commands through tool running in daemon mode,
+                       ignored for tools not in CTL_DAEMON_TOOLS.
+        :type daemon: bool
+        :raises: subprocess.CalledProcessError
         """
         self.tool = tool
         self.tbl = table
-
-    def _find_tbl(self, condition=None):
-        cmd = [self.tool, '-f', 'json', 'find', self.tbl]
+        self._pending = None
+        self._prefix = (tool,)
+        self._daemon_ctl = None
+        if daemon and tool in CTL_DAEMON_TOOLS:
+            self._daemon_ctl = ctl_daemon(tool)
+
+    def _run_tool(self, *args, raw=False):
+        if self._daemon_ctl:
+            out = ovs_appctl(self._daemon_ctl, 'run', *args)
+            return subprocess.CompletedProcess(
+                ('ovs-appctl', '-t', self._daemon_ctl, 'run') + args, 0,
+                stdout=out.encode('utf-8') if raw else out)
+        run = _run_bytes if raw else _run
+        return run(*self._prefix, *args)
+
+    def _mutate(self, *args):
+        if self._pending is not None:
+            self._pending.append(args)
+        else:
+            self._run_tool(*args)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Apply `clear`, `remove` and `set` calls in a single transaction.
+
+        The changes are applied with one invocation of the tool when the
+        context exits, and discarded if the context exits with an exception.
+        Nested use joins the outer transaction.
+
+        :raises: subprocess.CalledProcessError
+        """
+        if self._pending is not None:
+            yield self
+            return
+        self._pending = []
+        try:
+            yield self
+            cmd = []
+            for args in self._pending:
+                if cmd:
+                    cmd.append('--')
+                cmd.extend(args)
+            if cmd:
+                self._run_tool(*cmd)
+        finally:
+            self._pending = None
+
+    def _find_tbl_data(self, condition=None, columns=None):
+        cmd = ['-f', 'json']
+        if columns:
+            cmd.append('--columns={}'.format(','.join(columns)))
+        cmd.extend(('find', self.tbl))
         if condition:
             cmd.append(condition)
-        cp = _run(*cmd)
-        data = json.loads(cp.stdout)
+        # NOTE: Both JSON parsers accept bytes, no need to decode first.
+        cp = self._run_tool(*cmd, raw=True)
+        return _json_loads(cp.stdout)
+
+    def _find_tbl(self, condition=None, columns=None):
+        data = self._find_tbl_data(condition=condition, columns=columns)
+        headings = data['headings']
         for row in data['data']:
-            values = []
-            for col in row:
-                if isinstance(col, list):
-                    values.append(col[1])
-                else:
-                    values.append(col)
-            yield dict(zip(data['headings'], values))
+            yield dict(zip(
+                headings,
+                (col[1] if isinstance(col, list) else col for col in row)))
+
+    def _find_tbl_columns(self, condition=None, columns=None):
+        data = self._find_tbl_data(condition=condition, columns=columns)
+        result = {heading: [] for heading in data['headings']}
+        for heading, values in zip(data['headings'], zip(*data['data'])):
+            result[heading] = [
+                col[1] if isinstance(col, list) else col for col in values]
+        return result
 
     def __iter__(self):
         return self._find_tbl()
 
     def clear(self, rec, col):
-        _run(self.tool, 'clear', self.tbl, rec, col)
-
-    def find(self, condition):
-        return self._find_tbl(condition=condition)
+        self._mutate('clear', self.tbl, rec, col)
+
+    def find(self, condition, columns=None):
+        """Find records matching condition.
+
+        :param condition: Condition in the syntax of the tool's find command
+        :type condition: str
+        :param columns: Only retrieve these columns, all if not provided
+        :type columns: Optional[Iterable[str]]
+        :returns: Generator of records as dictionaries
+        :rtype: Iterator[Dict[str, Any]]
+        :raises: subprocess.CalledProcessError
+        """
+        return self._find_tbl(condition=condition, columns=columns)
+
+    def find_column(self, col, condition=None):
+        """Get values of a single column for records matching condition.
+
+        Cheaper than `find` when only one column is of interest as no
+        dictionary is built for each record.
+
+        :param col: Column to retrieve
+        :type col: str
+        :param condition: Condition in the syntax of the tool's find command,
+                          all records if not provided
+        :type condition: Optional[str]
+        :returns: Column values, one per matching record
+        :rtype: List[Any]
+        :raises: subprocess.CalledProcessError
+        """
+        return self._find_tbl_columns(condition=condition, columns=(col,))[col]
 
     def remove(self, rec, col, value):
-        _run(self.tool, 'remove', self.tbl, rec, col, value)
+        self._mutate('remove', self.tbl, rec, col, value)
 
     def set(self, rec, col, value):
-        _run(self.tool, 'set', self.tbl, rec, '{}={}'.format(col, value))
+        self._mutate('set', self.tbl, rec, '{}={}'.format(col, value))
@@ -145,7 +145,8 @@ class BaseOVNChassisCharm(charms_openstack.charm.OpenStackCharm):
             # LP: #1852200
             target = 'ptcp:6640:127.0.0.1'
             for el in ovn.SimpleOVSDB(
-                    'ovs-vsctl', 'manager').find('target="{}"'.format(target)):
+                    'ovs-vsctl', 'manager').find('target="{}"'.format(target),
+                                                 columns=('_uuid',)):
                 break
             else:
                 self.run('ovs-vsctl', '--id', '@manager',
@@ -186,7 +187,8 @@ class BaseOVNChassisCharm(charms_openstack.charm.OpenStackCharm):
 
         bridges = ovn.SimpleOVSDB('ovs-vsctl', 'bridge')
         ports = ovn.SimpleOVSDB('ovs-vsctl', 'port')
-        for bridge in bridges.find('external_ids:charm-ovn-chassis=managed'):
+        for bridge in bridges.find('external_ids:charm-ovn-chassis=managed',
+                                   columns=('name',)):
             # remove bridges and ports that are managed by us and no longer in
             # config
             if bridge['name'] not in ifbridges:
@@ -197,7 +199,8 @@ class BaseOVNChassisCharm(charms_openstack.charm.OpenStackCharm):
                 ovn.del_br(bridge['name'])
             else:
                 for port in ports.find('external_ids:charm-ovn-chassis={}'
-                                       .format(bridge['name'])):
+                                       .format(bridge['name']),
+                                       columns=('name',)):
                     if port['name'] not in ifbridges[bridge['name']]:
                         ch_core.hookenv.log('removing port "{}" from bridge '
                                             '"{}" as it is no longer present '
@@ -210,28 +213,37 @@ class BaseOVNChassisCharm(charms_openstack.charm.OpenStackCharm):
             if br not in ovnbridges:
                 continue
             try:
-                next(bridges.find('name={}'.format(br)))
+                next(bridges.find('name={}'.format(br), columns=('_uuid',)))
             except StopIteration:
                 ovn.add_br(br, ('charm-ovn-chassis', 'managed'))
             else:
                 ch_core.hookenv.log('skip adding already existing bridge "{}"'
                                     .format(br), level=ch_core.hookenv.DEBUG)
+            # NOTE: the same port may be configured more than once, e.g. by
+            # name and by MAC address, only add it once.
+            existing_ports = set(ovn.list_ports(br))
+            new_ports = []
             for port in ifbridges[br]:
-                if port not in ovn.list_ports(br):
-                    ovn.add_port(br, port, ('charm-ovn-chassis', br))
+                if port not in existing_ports:
+                    existing_ports.add(port)
+                    new_ports.append((port, ('charm-ovn-chassis', br)))
                 else:
                     ch_core.hookenv.log('skip adding already existing port '
                                         '"{}" to bridge "{}"'
                                         .format(port, br),
                                         level=ch_core.hookenv.DEBUG)
+            if new_ports:
+                ovn.add_ports(br, new_ports)
 
         opvs = ovn.SimpleOVSDB('ovs-vsctl', 'Open_vSwitch')
-        if ovn_br_map_str:
-            opvs.set('.', 'external_ids:ovn-bridge-mappings', ovn_br_map_str)
-            # NOTE(fnordahl): Workaround for LP: #1848757
-            opvs.set('.', 'external_ids:ovn-cms-options',
-                     'enable-chassis-as-gw')
-        else:
-            opvs.remove('.', 'external_ids', 'ovn-bridge-mappings')
-            # NOTE(fnordahl): Workaround for LP: #1848757
-            opvs.remove('.', 'external_ids', 'ovn-cms-options')
+        with opvs.transaction():
+            if ovn_br_map_str:
+                opvs.set('.', 'external_ids:ovn-bridge-mappings',
+                         ovn_br_map_str)
+                # NOTE(fnordahl): Workaround for LP: #1848757
+                opvs.set('.', 'external_ids:ovn-cms-options',
+                         'enable-chassis-as-gw')
+            else:
+                opvs.remove('.', 'external_ids', 'ovn-bridge-mappings')
+                # NOTE(fnordahl): Workaround for LP: #1848757
+                opvs.remove('.', 'external_ids', 'ovn-cms-options')
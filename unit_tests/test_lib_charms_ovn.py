@@ -48,12 +48,111 @@ class TestOVSDB(test_utils.PatchHelper):
         self.patch_object(ovn.subprocess, 'run')
         self.run.return_value = 'aReturn'
         self.assertEquals(ovn._run('aArg'), 'aReturn')
+        self.run.assert_called_once_with(
+            ('aArg',), input=None, stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT, check=True, universal_newlines=True)
+        self.run.reset_mock()
+        ovn._run('aArg', input='aInput')
+        self.run.assert_called_once_with(
+            ('aArg',), input='aInput', stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT, check=True, universal_newlines=True)
+
+    def test__run_bytes(self):
+        self.patch_object(ovn.subprocess, 'run')
+        self.run.return_value = 'aReturn'
+        self.assertEquals(ovn._run_bytes('aArg'), 'aReturn')
         self.run.assert_called_once_with(
             ('aArg',), stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
-            check=True, universal_newlines=True)
+            check=True)
+
+    def test__unixctl_path(self):
+        self.assertEquals(ovn._unixctl_path('/some/path.ctl'),
+                          '/some/path.ctl')
+        with mock.patch.object(ovn, 'open', create=True,
+                               new=mock.mock_open(read_data='42\n')) as o:
+            self.assertEquals(ovn._unixctl_path('ovn-northd'),
+                              '/var/run/openvswitch/ovn-northd.42.ctl')
+            o.assert_called_once_with('/var/run/openvswitch/ovn-northd.pid')
+
+    def test__unixctl(self):
+        self.patch_object(ovn, '_unixctl_sockets', new={})
+        self.patch_object(ovn, '_unixctl_ids')
+        self._unixctl_ids.__next__.return_value = 7
+        self.patch_object(ovn.socket, 'socket')
+        sock = mock.MagicMock()
+        self.socket.return_value = sock
+        sock.recv.side_effect = [
+            b'{"id":7,"error":null,',
+            b'"result":"Status: active\\n"}',
+        ]
+        self.assertEquals(ovn._unixctl('/some/ovn-northd.ctl', 'status'),
+                          'Status: active\n')
+        sock.connect.assert_called_once_with('/some/ovn-northd.ctl')
+        sock.sendall.assert_called_once_with(
+            b'{"method": "status", "params": [], "id": 7}')
+        # connection is reused
+        sock.recv.side_effect = [
+            b'{"id":7,"error":"unknown command","result":null}']
+        with self.assertRaises(subprocess.CalledProcessError):
+            ovn._unixctl('/some/ovn-northd.ctl', 'bogus', 'arg')
+        self.assertEquals(self.socket.call_count, 1)
+        # stale replies are skipped, also when received along with the reply
+        sock.recv.side_effect = [
+            b'{"id":6,"error":null,"result":"old"}\n{"id":7,"error":null,',
+            b'"result":"new"}',
+        ]
+        self.assertEquals(ovn._unixctl('/some/ovn-northd.ctl', 'status'),
+                          'new')
+        # connections closed after sending the request are dropped, and the
+        # error is not an OSError so callers do not retry the command
+        sock.recv.side_effect = [b'']
+        with self.assertRaises(subprocess.CalledProcessError):
+            ovn._unixctl('/some/ovn-northd.ctl', 'status')
+        self.assertDictEqual(ovn._unixctl_sockets, {})
+        sock.close.assert_called_once_with()
+
+    def test__unixctl_reconnect(self):
+        self.patch_object(ovn, '_unixctl_ids')
+        self._unixctl_ids.__next__.return_value = 7
+        stale = mock.MagicMock()
+        stale.sendall.side_effect = BrokenPipeError
+        self.patch_object(ovn, '_unixctl_sockets',
+                          new={'/some/ovn-northd.ctl': (stale,
+                                                        mock.MagicMock())})
+        self.patch_object(ovn.socket, 'socket')
+        sock = mock.MagicMock()
+        self.socket.return_value = sock
+        sock.recv.side_effect = [b'{"id":7,"error":null,"result":"ok"}']
+        self.assertEquals(ovn._unixctl('/some/ovn-northd.ctl', 'status'),
+                          'ok')
+        stale.close.assert_called_once_with()
+        sock.connect.assert_called_once_with('/some/ovn-northd.ctl')
+        # only one reconnect is attempted
+        ovn._unixctl_sockets.clear()
+        sock.sendall.side_effect = BrokenPipeError
+        with self.assertRaises(OSError):
+            ovn._unixctl('/some/ovn-northd.ctl', 'status')
+        self.assertEquals(sock.sendall.call_count, 3)
+
+    def test__unixctl_disconnect(self):
+        sock = mock.MagicMock()
+        self.patch_object(ovn, '_unixctl_sockets',
+                          new={'/some/path.ctl': (sock, mock.MagicMock())})
+        ovn._unixctl_disconnect('/some/path.ctl')
+        sock.close.assert_called_once_with()
+        self.assertDictEqual(ovn._unixctl_sockets, {})
+        ovn._unixctl_disconnect('/some/path.ctl')
 
     def test_ovs_appctl(self):
+        self.patch_object(ovn, '_unixctl')
+        self._unixctl.return_value = 'aResult'
         self.patch_object(ovn, '_run')
+        self.assertEquals(ovn.ovs_appctl('ovnnb_db', 'cluster/status'),
+                          'aResult')
+        self._unixctl.assert_called_once_with(
+            '/var/run/openvswitch/ovnnb_db.ctl', 'cluster/status')
+        self.assertFalse(self._run.called)
+        self._unixctl.side_effect = OSError
         ovn.ovs_appctl('ovn-northd', 'is-paused')
         self._run.assert_called_once_with('ovs-appctl', '-t', 'ovn-northd',
                                           'is-paused')
@@ -68,7 +167,50 @@ class TestOVSDB(test_utils.PatchHelper):
                                           '/var/run/openvswitch/ovnsb_db.ctl',
                                           'cluster/status')
 
+    def test_ovs_appctl_no_rerun(self):
+        self.patch_object(ovn, '_unixctl_sockets', new={})
+        self.patch_object(ovn.socket, 'socket')
+        sock = mock.MagicMock()
+        self.socket.return_value = sock
+        sock.recv.return_value = b''
+        self.patch_object(ovn, '_run')
+        with self.assertRaises(subprocess.CalledProcessError):
+            ovn.ovs_appctl('/some/ovn-northd.ctl', 'exit')
+        sock.sendall.assert_called_once_with(mock.ANY)
+        self.assertFalse(self._run.called)
+
+    def test__ttl_cache(self):
+        self.patch_object(ovn.time, 'monotonic')
+        self.monotonic.return_value = 100
+        results = mock.MagicMock()
+        results.side_effect = [{'r': ['first']}, {'r': ['second']},
+                               {'r': ['third']}]
+
+        def f(a, k=None):
+            return results(a, k=k)
+
+        cached = ovn._ttl_cache(2)(f)
+        self.assertEquals(cached('a'), {'r': ['first']})
+        self.monotonic.return_value = 101
+        # defaults are filled in, so these share the cached result
+        self.assertEquals(cached('a', k=None), {'r': ['first']})
+        self.assertEquals(cached(a='a', k=None), {'r': ['first']})
+        results.assert_called_once_with('a', k=None)
+        # callers get a copy
+        cached('a')['r'].append('modified')
+        self.assertEquals(cached('a'), {'r': ['first']})
+        self.monotonic.return_value = 102
+        self.assertEquals(cached('a'), {'r': ['second']})
+        cached.cache_clear()
+        self.assertEquals(cached('a'), {'r': ['third']})
+
+    def test__iter_lines(self):
+        self.assertEquals(list(ovn._iter_lines('')), [])
+        self.assertEquals(list(ovn._iter_lines('a\n\nb')), ['a', '', 'b'])
+        self.assertEquals(list(ovn._iter_lines('a\nb\n')), ['a', 'b'])
+
     def test_cluster_status(self):
+        ovn.cluster_status.cache_clear()
         self.patch_object(ovn, 'ovs_appctl')
         self.ovs_appctl.return_value = CLUSTER_STATUS
         expect = {
@@ -96,6 +238,23 @@ class TestOVSDB(test_utils.PatchHelper):
         self.ovs_appctl.assert_called_once_with('ovnnb_db', 'cluster/status',
                                                 'OVN_Northbound')
 
+    def test_cluster_status_many(self):
+        self.patch_object(ovn, 'cluster_status')
+        self.cluster_status.side_effect = lambda target: {'name': target}
+        self.assertDictEqual(ovn.cluster_status_many([]), {})
+        self.assertFalse(self.cluster_status.called)
+        self.assertDictEqual(
+            ovn.cluster_status_many(['ovnnb_db', 'ovnsb_db', 'ovnnb_db']),
+            {
+                'ovnnb_db': {'name': 'ovnnb_db'},
+                'ovnsb_db': {'name': 'ovnsb_db'},
+            })
+        self.cluster_status.assert_has_calls([
+            mock.call('ovnnb_db'),
+            mock.call('ovnsb_db'),
+        ], any_order=True)
+        self.assertEquals(self.cluster_status.call_count, 2)
+
     def test_is_cluster_leader(self):
         self.patch_object(ovn, 'cluster_status')
         self.cluster_status.return_value = {'leader': 'abcd'}
@@ -104,12 +263,25 @@ class TestOVSDB(test_utils.PatchHelper):
         self.assertTrue(ovn.is_cluster_leader('ovnnb_db'))
 
     def test_is_northd_active(self):
+        ovn.is_northd_active.cache_clear()
         self.patch_object(ovn, 'ovs_appctl')
         self.ovs_appctl.return_value = NORTHD_STATUS_ACTIVE
         self.assertTrue(ovn.is_northd_active())
         self.ovs_appctl.assert_called_once_with('ovn-northd', 'status')
         self.ovs_appctl.return_value = NORTHD_STATUS_STANDBY
+        self.assertTrue(ovn.is_northd_active())
+        ovn.is_northd_active.cache_clear()
+        self.assertFalse(ovn.is_northd_active())
+        ovn.is_northd_active.cache_clear()
+        self.ovs_appctl.return_value = 'Status: active'
+        self.assertTrue(ovn.is_northd_active())
+        ovn.is_northd_active.cache_clear()
+        self.ovs_appctl.return_value = 'Other: active\n'
+        self.assertFalse(ovn.is_northd_active())
+        ovn.is_northd_active.cache_clear()
+        self.ovs_appctl.side_effect = subprocess.CalledProcessError(1, 'cmd')
         self.assertFalse(ovn.is_northd_active())
+        ovn.is_northd_active.cache_clear()
 
     def test_add_br(self):
         self.patch_object(ovn, '_run')
@@ -137,6 +309,83 @@ class TestOVSDB(test_utils.PatchHelper):
             mock.call('ip', 'link', 'set', 'enp3s0f0', 'up'),
             mock.call('ovs-vsctl', 'add-port', 'br-x', 'enp3s0f0'),
         ])
+        self._run.reset_mock()
+        ovn.add_port('br-x', 'enp3s0f0', ('charm', 'managed'))
+        self._run.assert_has_calls([
+            mock.call('ip', 'link', 'set', 'enp3s0f0', 'up'),
+            mock.call('ovs-vsctl', 'add-port', 'br-x', 'enp3s0f0', '--',
+                      'set', 'port', 'enp3s0f0',
+                      'external_ids:charm=managed'),
+        ])
+        self.assertEquals(self._run.call_count, 2)
+
+    def test_add_ports(self):
+        self.patch_object(ovn, '_run')
+        ovn.add_ports('br-x', [])
+        self.assertFalse(self._run.called)
+        ovn.add_ports('br-x', [('enp3s0f0', ('charm', 'managed')),
+                               ('enp3s0f1', None),
+                               ('enp3s0f0', ('charm', 'other'))])
+        self._run.assert_has_calls([
+            mock.call('ip', '-batch', '-',
+                      input='link set enp3s0f0 up\nlink set enp3s0f1 up\n'),
+            mock.call('ovs-vsctl', '--', 'add-port', 'br-x', 'enp3s0f0',
+                      '--', 'set', 'port', 'enp3s0f0',
+                      'external_ids:charm=managed', '--',
+                      'add-port', 'br-x', 'enp3s0f1'),
+        ])
+        self.assertEquals(self._run.call_count, 2)
+
+    def test_ctl_daemon(self):
+        self.patch_object(ovn, '_ctl_daemons', new={})
+        self.patch_object(ovn.subprocess, 'check_output')
+        self.patch_object(ovn.atexit, 'register')
+        self.check_output.side_effect = [
+            '/var/run/ovn/ovn-nbctl.1234.ctl\n',
+            '/var/run/ovn/ovn-sbctl.1234.ctl\n',
+        ]
+        with self.assertRaises(ValueError):
+            ovn.ctl_daemon('ovs-vsctl')
+        self.assertEquals(ovn.ctl_daemon('ovn-nbctl'),
+                          '/var/run/ovn/ovn-nbctl.1234.ctl')
+        self.assertEquals(ovn.ctl_daemon('ovn-nbctl'),
+                          '/var/run/ovn/ovn-nbctl.1234.ctl')
+        self.check_output.assert_called_once_with(
+            ('ovn-nbctl', '--detach'), universal_newlines=True)
+        self.register.assert_called_once_with(ovn.stop_ctl_daemons)
+        self.assertEquals(ovn.ctl_daemon('ovn-sbctl'),
+                          '/var/run/ovn/ovn-sbctl.1234.ctl')
+        self.register.assert_called_once_with(ovn.stop_ctl_daemons)
+
+    def test_stop_ctl_daemons(self):
+        self.patch_object(ovn, '_ctl_daemons',
+                          new={'ovn-nbctl': '/some/ovn-nbctl.ctl'})
+        self.patch_object(ovn, 'ovs_appctl')
+        self.patch_object(ovn.atexit, 'unregister')
+        self.patch_object(ovn, '_unixctl_disconnect')
+        ovn.stop_ctl_daemons()
+        self.ovs_appctl.assert_called_once_with('/some/ovn-nbctl.ctl', 'exit')
+        self.assertDictEqual(ovn._ctl_daemons, {})
+        self.unregister.assert_called_once_with(ovn.stop_ctl_daemons)
+        self._unixctl_disconnect.assert_called_once_with(
+            '/some/ovn-nbctl.ctl')
+        # a failure to stop one daemon does not leave the others running
+        ovn._ctl_daemons.update({
+            'ovn-nbctl': '/some/ovn-nbctl.ctl',
+            'ovn-sbctl': '/some/ovn-sbctl.ctl',
+        })
+        self.ovs_appctl.reset_mock()
+        self.ovs_appctl.side_effect = [
+            subprocess.CalledProcessError(2, 'cmd'), None]
+        self._unixctl_disconnect.reset_mock()
+        with self.assertRaises(subprocess.CalledProcessError):
+            ovn.stop_ctl_daemons()
+        self.ovs_appctl.assert_has_calls([
+            mock.call('/some/ovn-nbctl.ctl', 'exit'),
+            mock.call('/some/ovn-sbctl.ctl', 'exit'),
+        ], any_order=True)
+        self.assertDictEqual(ovn._ctl_daemons, {})
+        self.assertEquals(self._unixctl_disconnect.call_count, 2)
 
     def test_list_ports(self):
         self.patch_object(ovn, '_run')
@@ -163,10 +412,11 @@ class TestSimpleOVSDB(Helper):
         self.target = ovn.SimpleOVSDB('atool', 'atable')
 
     def test__find_tbl(self):
-        self.patch_object(ovn, '_run')
+        self.patch_object(ovn, '_run_bytes')
         cp = mock.MagicMock()
-        cp.stdout = mock.PropertyMock().return_value = VSCTL_BRIDGE_TBL
-        self._run.return_value = cp
+        cp.stdout = mock.PropertyMock().return_value = (
+            VSCTL_BRIDGE_TBL.encode())
+        self._run_bytes.return_value = cp
         self.maxDiff = None
         expect = {
             '_uuid': '1e21ba48-61ff-4b32-b35e-cb80411da351',
@@ -198,14 +448,46 @@ class TestSimpleOVSDB(Helper):
         for el in self.target:
             self.assertDictEqual(el, expect)
             break
-        self._run.assert_called_once_with(
+        self._run_bytes.assert_called_once_with(
             'atool', '-f', 'json', 'find', 'atable')
-        self._run.reset_mock()
+        self._run_bytes.reset_mock()
         # this in effect also tests the find front end method
         for el in self.target.find(condition='name=br-test'):
             break
-        self._run.assert_called_once_with(
+        self._run_bytes.assert_called_once_with(
             'atool', '-f', 'json', 'find', 'atable', 'name=br-test')
+        self._run_bytes.reset_mock()
+        for el in self.target.find('name=br-test', columns=('_uuid', 'name')):
+            break
+        self._run_bytes.assert_called_once_with(
+            'atool', '-f', 'json', '--columns=_uuid,name', 'find', 'atable',
+            'name=br-test')
+
+    def test__find_tbl_columns(self):
+        self.patch_object(ovn, '_run_bytes')
+        cp = mock.MagicMock()
+        cp.stdout = mock.PropertyMock().return_value = (
+            VSCTL_BRIDGE_TBL.encode())
+        self._run_bytes.return_value = cp
+        result = self.target._find_tbl_columns()
+        self.assertEquals(result['name'], ['br-test', 'br-int'])
+        self.assertEquals(result['_uuid'], [
+            '1e21ba48-61ff-4b32-b35e-cb80411da351',
+            'bb685b0f-a383-40a1-b7a5-b5c2066bfa42'])
+        self.assertEquals(result['external_ids'], [
+            [['charm-ovn-chassis', 'managed'], ['other', 'value']],
+            []])
+        self.assertEquals(len(result), 23)
+        cp.stdout = b'{"data":[],"headings":["name"]}'
+        self.assertDictEqual(self.target._find_tbl_columns(), {'name': []})
+
+    def test_find_column(self):
+        self.patch_target('_find_tbl_columns')
+        self._find_tbl_columns.return_value = {'name': ['br-test', 'br-int']}
+        self.assertEquals(self.target.find_column('name', 'fail_mode=secure'),
+                          ['br-test', 'br-int'])
+        self._find_tbl_columns.assert_called_once_with(
+            condition='fail_mode=secure', columns=('name',))
 
     def test_clear(self):
         self.patch_object(ovn, '_run')
@@ -230,3 +512,53 @@ class TestSimpleOVSDB(Helper):
         self._run.assert_called_once_with(
             'atool', 'set', 'atable',
             '1e21ba48-61ff-4b32-b35e-cb80411da351', 'external_ids:other=value')
+
+    def test_transaction(self):
+        self.patch_object(ovn, '_run')
+        with self.target.transaction():
+            with self.target.transaction():
+                self.target.set('.', 'external_ids:a', 'x')
+            self.target.remove('.', 'external_ids', 'b')
+            self.target.clear('.', 'other_config')
+            self.assertFalse(self._run.called)
+        self._run.assert_called_once_with(
+            'atool', 'set', 'atable', '.', 'external_ids:a=x', '--',
+            'remove', 'atable', '.', 'external_ids', 'b', '--',
+            'clear', 'atable', '.', 'other_config')
+        self._run.reset_mock()
+        with self.assertRaises(RuntimeError):
+            with self.target.transaction():
+                self.target.set('.', 'external_ids:a', 'x')
+                raise RuntimeError
+        self.assertFalse(self._run.called)
+        with self.target.transaction():
+            pass
+        self.assertFalse(self._run.called)
+        self.target.set('.', 'external_ids:a', 'x')
+        self._run.assert_called_once_with(
+            'atool', 'set', 'atable', '.', 'external_ids:a=x')
+
+    def test_daemon(self):
+        self.patch_object(ovn, 'ctl_daemon')
+        self.ctl_daemon.return_value = '/some/ovn-nbctl.ctl'
+        self.patch_object(ovn, '_run')
+        target = ovn.SimpleOVSDB('ovs-vsctl', 'atable', daemon=True)
+        self.assertFalse(self.ctl_daemon.called)
+        target.clear('.', 'external_ids')
+        self._run.assert_called_once_with(
+            'ovs-vsctl', 'clear', 'atable', '.', 'external_ids')
+        self._run.reset_mock()
+        self.patch_object(ovn, 'ovs_appctl')
+        self.ovs_appctl.return_value = '{"data":[],"headings":["name"]}'
+        target = ovn.SimpleOVSDB('ovn-nbctl', 'atable', daemon=True)
+        self.ctl_daemon.assert_called_once_with('ovn-nbctl')
+        target.clear('.', 'external_ids')
+        self.ovs_appctl.assert_called_once_with(
+            '/some/ovn-nbctl.ctl', 'run',
+            'clear', 'atable', '.', 'external_ids')
+        self.assertFalse(self._run.called)
+        # output is handed to the JSON parser as bytes, like from _run_bytes
+        self.assertEquals(target.find_column('name'), [])
+        cp = target._run_tool('-f', 'json', 'find', 'atable', raw=True)
+        self.assertEquals(cp.stdout, b'{"data":[],"headings":["name"]}')
+        self.assertEquals(cp.returncode, 0)
@@ -148,7 +148,7 @@ class TestOVNChassisCharm(Helper):
         self.SimpleOVSDB.return_value = managers
         self.target.configure_ovs(ovsdb_interface)
         managers.find.assert_called_once_with(
-            'target="ptcp:6640:127.0.0.1"')
+            'target="ptcp:6640:127.0.0.1"', columns=('_uuid',))
         self.run.assert_has_calls([
             mock.call('ovs-vsctl', 'set-ssl', mock.ANY, mock.ANY, mock.ANY),
             mock.call('ovs-vsctl', 'set', 'open', '.',
@@ -182,7 +182,7 @@ class TestOVNChassisCharm(Helper):
         self.NeutronPortContext.return_value = npc
         self.patch_target('config')
         self.config.__getitem__.side_effect = [
-            '00:01:02:03:04:05:br-provider eth5:br-other',
+            '00:01:02:03:04:05:br-provider eth0:br-provider eth5:br-other',
             'provider:br-provider other:br-other']
         self.patch_object(ovn_charm.ovn, 'SimpleOVSDB')
         bridges = mock.MagicMock()
@@ -202,27 +202,33 @@ class TestOVNChassisCharm(Helper):
         self.patch_object(ovn_charm.ovn, 'add_br')
         self.patch_object(ovn_charm.ovn, 'list_ports')
         self.list_ports().__iter__.return_value = []
-        self.patch_object(ovn_charm.ovn, 'add_port')
+        self.patch_object(ovn_charm.ovn, 'add_ports')
         self.target.configure_bridges()
         npc.resolve_ports.assert_has_calls([
-            mock.call(['00:01:02:03:04:05']),
+            mock.call(['00:01:02:03:04:05', 'eth0']),
             mock.call(['eth5']),
         ], any_order=True)
         bridges.find.assert_has_calls([
-            mock.call('name=br-provider'),
-            mock.call('name=br-other'),
+            mock.call('external_ids:charm-ovn-chassis=managed',
+                      columns=('name',)),
+            mock.call('name=br-provider', columns=('_uuid',)),
+            mock.call('name=br-other', columns=('_uuid',)),
         ], any_order=True)
+        ports.find.assert_called_once_with(
+            'external_ids:charm-ovn-chassis=br-other', columns=('name',))
         self.del_br.assert_called_once_with('delete-bridge')
         self.del_port.assert_called_once_with('br-other', 'delete-port')
         self.add_br.assert_has_calls([
             mock.call('br-provider', ('charm-ovn-chassis', 'managed')),
             mock.call('br-other', ('charm-ovn-chassis', 'managed')),
         ], any_order=True)
-        self.add_port.assert_has_calls([
+        self.add_ports.assert_has_calls([
             mock.call(
-                'br-provider', 'eth0', ('charm-ovn-chassis', 'br-provider')),
+                'br-provider',
+                [('eth0', ('charm-ovn-chassis', 'br-provider'))]),
             mock.call(
-                'br-other', 'eth5', ('charm-ovn-chassis', 'br-other')),
+                'br-other',
+                [('eth5', ('charm-ovn-chassis', 'br-other'))]),
         ], any_order=True)
         opvs.set.assert_has_calls([
             mock.call('.', 'external_ids:ovn-bridge-mappings',